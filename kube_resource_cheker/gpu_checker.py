@@ -1,6 +1,11 @@
 import argparse
-import subprocess
-import json
+import io
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import orjson
+from kube_api import run_kubectl
 
 # ANSI escape codes for colors
 PRIMARY_COLOR = "\033[93m"  # 亮黄色
@@ -8,15 +13,71 @@ SECONDARY_COLOR = "\033[93m"  # 亮黄色
 THIRDARY_COLOR = "\033[92m"  # 亮绿色
 RESET_COLOR = "\033[0m"
 
+# 占用 GPU 的 Pod 输出模板：namespace, name, request
+POD_TEMPLATE = f"    {THIRDARY_COLOR}%s/%s requests GPU: %s{RESET_COLOR}"
 
-def get_nodes_with_label(label):
-    """Get all node names and IPs with a specific label."""
-    result = subprocess.run(
-        ["kubectl", "get", "nodes", "-l", label, "-o", "json"],
-        capture_output=True,
+# 由 kubectl 只输出统计 GPU 需要的字段，每个 Pod 一行：
+# nodeName, namespace, name, phase, 各容器的 GPU 请求（逗号分隔）
+POD_GPU_JSONPATH = (
+    "{range .items[*]}"
+    '{.spec.nodeName}{"\\t"}{.metadata.namespace}{"\\t"}'
+    '{.metadata.name}{"\\t"}{.status.phase}{"\\t"}'
+    '{range .spec.containers[*]}{.resources.requests.nvidia\\.com/gpu}{","}{end}'
+    '{"\\n"}'
+    "{end}"
+)
+
+
+def fetch_nodes(label):
+    """Fetch data of nodes matching the label selector."""
+    # resourceVersion=0 让 apiserver 直接从 watch cache 返回，不必读 etcd
+    nodes_output = run_kubectl(
+        [
+            "get",
+            "--raw",
+            f"/api/v1/nodes?resourceVersion=0&labelSelector={quote(label)}",
+        ]
+    )
+    return orjson.loads(nodes_output)["items"]
+
+
+def fetch_pods():
+    """Fetch GPU requests of all pods."""
+    # kubectl 失败时直接退出，避免把空输出当成没有 Pod 使用 GPU
+    pods_output = run_kubectl(
+        ["get", "pods", "--all-namespaces", "-o", f"jsonpath={POD_GPU_JSONPATH}"],
         text=True,
     )
-    nodes = json.loads(result.stdout)["items"]
+
+    pods_data = []
+    for line in pods_output.splitlines():
+        node_name, namespace, pod_name, phase, gpu_requests = line.split("\t")
+        gpu_requests = [request for request in gpu_requests.split(",") if request]
+        # 只保留请求了 GPU 的 Pod
+        if gpu_requests:
+            pods_data.append(
+                {
+                    "node_name": node_name,
+                    "namespace": namespace,
+                    "name": pod_name,
+                    "phase": phase,
+                    "gpu_requests": gpu_requests,
+                }
+            )
+    return pods_data
+
+
+def fetch_data(label):
+    """Fetch nodes with the label and all pods data in one go."""
+    # 并发请求 nodes 和 pods，总耗时取决于较慢的那个请求
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        nodes_future = executor.submit(fetch_nodes, label)
+        pods_future = executor.submit(fetch_pods)
+        return nodes_future.result(), pods_future.result()
+
+
+def get_nodes_with_label(nodes_data):
+    """Get all node names and IPs of the nodes fetched with the label."""
     return [
         (
             node["metadata"]["name"],
@@ -25,53 +86,34 @@ def get_nodes_with_label(label):
                 for addr in node["status"]["addresses"]
                 if addr["type"] == "InternalIP"
             ),
+            node,
         )
-        for node in nodes
+        for node in nodes_data
     ]
 
 
-def get_total_gpu(node_name):
+def get_total_gpu(node_data):
     """Get the total number of GPUs allocatable on the specified node."""
-    result = subprocess.run(
-        ["kubectl", "get", "node", node_name, "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    node_info = json.loads(result.stdout)
     # Make sure 'nvidia.com/gpu' exists in 'allocatable' resources
-    return int(node_info["status"]["allocatable"].get("nvidia.com/gpu", 0))
+    return int(node_data["status"]["allocatable"].get("nvidia.com/gpu", 0))
 
 
-def get_used_gpu(node_name):
+def get_used_gpu(pods_on_node):
     """Calculate GPU requests for both active tasks and all tasks on the specified node."""
-    result = subprocess.run(
-        ["kubectl", "get", "pods", "--all-namespaces", "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    pods = json.loads(result.stdout)["items"]
-
     used_gpu_active = 0  # 用于统计排除 Complete 状态的请求 GPU 数量
     used_gpu_all = 0  # 用于统计所有任务（包括 Complete）的请求 GPU 数量
     using_pods = []
 
-    for pod in pods:
-        # 确保 pod 中有 "nodeName" 键
-        if pod["spec"].get("nodeName") == node_name:
-            for container in pod["spec"]["containers"]:
-                gpu_request = (
-                    container.get("resources", {})
-                    .get("requests", {})
-                    .get("nvidia.com/gpu")
-                )
-                if gpu_request:
-                    used_gpu_all += int(gpu_request)  # count all requested GPUs
-                    # if phase is not "Succeeded", then the task is active
-                    if pod["status"]["phase"] == "Running":
-                        used_gpu_active += int(gpu_request)
-                        using_pods.append(
-                            f'{pod["metadata"]["namespace"]}/{pod["metadata"]["name"]} requests GPU: {gpu_request}'
-                        )
+    for pod in pods_on_node:
+        running = pod["phase"] == "Running"
+        for gpu_request in pod["gpu_requests"]:
+            gpu_count = int(gpu_request)
+            used_gpu_all += gpu_count  # count all requested GPUs
+            # if phase is not "Succeeded", then the task is active
+            if running:
+                used_gpu_active += gpu_count
+                # 只记录 Pod 信息，输出时再格式化
+                using_pods.append((pod["namespace"], pod["name"], gpu_request))
 
     return used_gpu_active, used_gpu_all, using_pods
 
@@ -79,41 +121,55 @@ def get_used_gpu(node_name):
 def main(label):
     # label = input("Enter the label to filter nodes (e.g., environment=production): ")
 
-    print("Retrieving GPU resource information for nodes with label:", label)
-    print("--------------------------------------------------------")
+    # 输出先写入缓冲区，最后一次性写到 stdout
+    buf = io.StringIO()
+
+    print("Retrieving GPU resource information for nodes with label:", label, file=buf)
+    print("--------------------------------------------------------", file=buf)
+
+    nodes_data, pods_data = fetch_data(label)
+    nodes = get_nodes_with_label(nodes_data)
+
+    # 按 nodeName 建立 Pod 索引，避免每个节点都遍历全部 Pod
+    pods_by_node = defaultdict(list)
+    for pod in pods_data:
+        pods_by_node[pod["node_name"]].append(pod)
 
-    nodes = get_nodes_with_label(label)
     available_gpu_nodes_excluding_complete = []
     available_gpu_nodes_including_complete = []
 
     total_gpu_all = 0
 
-    for node_name, node_ip in nodes:
-        total_gpu = get_total_gpu(node_name)
+    for node_name, node_ip, node_data in nodes:
+        total_gpu = get_total_gpu(node_data)
         total_gpu_all += total_gpu
-        used_gpu_active, used_gpu_all, using_pods = get_used_gpu(node_name)
+        used_gpu_active, used_gpu_all, using_pods = get_used_gpu(
+            pods_by_node.get(node_name, [])
+        )
 
         # 分别计算排除和包含 Complete 状态的剩余 GPU 数量
         available_gpu_excluding_complete = total_gpu - used_gpu_active
         available_gpu_including_complete = total_gpu - used_gpu_all
 
         # Display available GPUs with different colors for emphasis
-        print(f"Node: {node_ip} ({node_name})")
+        print(f"Node: {node_ip} ({node_name})", file=buf)
         print(
-            f"  Available GPUs: {PRIMARY_COLOR}{available_gpu_excluding_complete}{RESET_COLOR}, {SECONDARY_COLOR}{available_gpu_including_complete}{RESET_COLOR} (Include Complete Tasks)"
+            f"  Available GPUs: {PRIMARY_COLOR}{available_gpu_excluding_complete}{RESET_COLOR}, {SECONDARY_COLOR}{available_gpu_including_complete}{RESET_COLOR} (Include Complete Tasks)",
+            file=buf,
         )
         print(
-            f"  Total: {total_gpu}   Used: {used_gpu_active}    Requested: {used_gpu_all}"
+            f"  Total: {total_gpu}   Used: {used_gpu_active}    Requested: {used_gpu_all}",
+            file=buf,
         )
 
         if using_pods:
-            print("  Pods using GPUs (Excluded Complete tasks):")
+            print("  Pods using GPUs (Excluded Complete tasks):", file=buf)
             for pod in using_pods:
-                print(f"    {THIRDARY_COLOR}{pod}{RESET_COLOR}")
+                print(POD_TEMPLATE % pod, file=buf)
         else:
-            print("  No Pods are using GPUs.")
+            print("  No Pods are using GPUs.", file=buf)
 
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
 
         # Append nodes with available GPUs to the respective lists for summary
         if available_gpu_excluding_complete > 0:
@@ -130,32 +186,36 @@ def main(label):
         available_gpu_nodes_excluding_complete.sort()
         node_count_excluding = len(available_gpu_nodes_excluding_complete)
         print(
-            f"\nNodes with Available GPUs (Excluding Complete): {PRIMARY_COLOR}{node_count_excluding}{RESET_COLOR}"
+            f"\nNodes with Available GPUs (Excluding Complete): {PRIMARY_COLOR}{node_count_excluding}{RESET_COLOR}",
+            file=buf,
         )
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
         for node_ip, node_name, available_gpu in available_gpu_nodes_excluding_complete:
             print(
-                f"Node: {THIRDARY_COLOR}{node_ip}{RESET_COLOR} ({node_name}) - Available GPUs (Excluding Complete): {PRIMARY_COLOR}{available_gpu}{RESET_COLOR}"
+                f"Node: {THIRDARY_COLOR}{node_ip}{RESET_COLOR} ({node_name}) - Available GPUs (Excluding Complete): {PRIMARY_COLOR}{available_gpu}{RESET_COLOR}",
+                file=buf,
             )
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
     else:
-        print("\nNo nodes with available GPUs (Excluding Complete).")
+        print("\nNo nodes with available GPUs (Excluding Complete).", file=buf)
 
     # Output summary of nodes with available GPUs (including Complete)
     if available_gpu_nodes_including_complete:
         available_gpu_nodes_including_complete.sort()
         node_count_including = len(available_gpu_nodes_including_complete)
         print(
-            f"\nNodes with Available GPUs (Including Complete): {PRIMARY_COLOR}{node_count_including}{RESET_COLOR}"
+            f"\nNodes with Available GPUs (Including Complete): {PRIMARY_COLOR}{node_count_including}{RESET_COLOR}",
+            file=buf,
         )
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
         for node_ip, node_name, available_gpu in available_gpu_nodes_including_complete:
             print(
-                f"Node: {THIRDARY_COLOR}{node_ip}{RESET_COLOR} ({node_name}) - Available GPUs (Including Complete): {SECONDARY_COLOR}{available_gpu}{RESET_COLOR}"
+                f"Node: {THIRDARY_COLOR}{node_ip}{RESET_COLOR} ({node_name}) - Available GPUs (Including Complete): {SECONDARY_COLOR}{available_gpu}{RESET_COLOR}",
+                file=buf,
             )
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
     else:
-        print("\nNo nodes with available GPUs (Including Complete).")
+        print("\nNo nodes with available GPUs (Including Complete).", file=buf)
 
     # Output summary of total GPUs and utilization rate
     total_requested_excluding = sum(
@@ -165,11 +225,12 @@ def main(label):
         total_gpu - available_gpu
         for node_ip, node_name, available_gpu in available_gpu_nodes_including_complete
     )
-    print(f"\n{PRIMARY_COLOR}Summary{RESET_COLOR}")
-    print("--------------------------------------------------------")
-    print(f"Total GPUs across all nodes: {total_gpu_all}")
+    print(f"\n{PRIMARY_COLOR}Summary{RESET_COLOR}", file=buf)
+    print("--------------------------------------------------------", file=buf)
+    print(f"Total GPUs across all nodes: {total_gpu_all}", file=buf)
     print(
-        f"Avaliable GPUs across all nodes: {PRIMARY_COLOR}{total_requested_excluding}{RESET_COLOR} (Excluding Complete), {SECONDARY_COLOR}{total_requested_including}{RESET_COLOR}"
+        f"Avaliable GPUs across all nodes: {PRIMARY_COLOR}{total_requested_excluding}{RESET_COLOR} (Excluding Complete), {SECONDARY_COLOR}{total_requested_including}{RESET_COLOR}",
+        file=buf,
     )
 
     if total_gpu_all == 0:
@@ -178,10 +239,13 @@ def main(label):
         utilization_rate = 1 - total_requested_excluding / total_gpu_all
 
     print(
-        f"Utilization rate: {THIRDARY_COLOR}{utilization_rate:.2%}{RESET_COLOR} (Excluding Complete)"
+        f"Utilization rate: {THIRDARY_COLOR}{utilization_rate:.2%}{RESET_COLOR} (Excluding Complete)",
+        file=buf,
     )
 
-    print("\n")
+    print("\n", file=buf)
+
+    sys.stdout.write(buf.getvalue())
 
 
 if __name__ == "__main__":
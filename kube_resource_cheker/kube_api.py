@@ -0,0 +1,110 @@
+import atexit
+import http.client
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+import orjson
+
+# 只启动一个 kubectl proxy，之后所有请求都走本地 HTTP 长连接，
+# 认证和到 apiserver 的 TLS 握手只需要做一次
+PROXY_READY_RE = re.compile(r"Starting to serve on 127\.0\.0\.1:(\d+)")
+_proxy_lock = threading.Lock()
+_proxy_port = None
+# http.client 的连接不是线程安全的，每个线程各自保持一个连接
+_local = threading.local()
+
+
+def _set_parent_death_signal():
+    """Make the kernel send SIGTERM to the proxy when the script dies (Linux)."""
+    import ctypes
+
+    PR_SET_PDEATHSIG = 1
+    ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+
+def _exit_on_signal(signum, frame):
+    # 转成 SystemExit，让 atexit 有机会关闭 proxy
+    sys.exit(128 + signum)
+
+
+def _stop_proxy(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def start_proxy():
+    """Start `kubectl proxy` on a free local port and return the port.
+
+    Call it from the main thread: the proxy is tied to the lifetime of the
+    thread that starts it, and signal handlers can only be installed there.
+    """
+    global _proxy_port
+    with _proxy_lock:
+        if _proxy_port is not None:
+            return _proxy_port
+
+        # stderr 写入临时文件：启动前的警告不会被当成失败，
+        # 之后的日志也不会因为管道写满而阻塞 proxy
+        stderr_file = tempfile.TemporaryFile()
+        proc = subprocess.Popen(
+            ["kubectl", "proxy", "--address=127.0.0.1", "--port=0"],
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            text=True,
+            preexec_fn=(
+                _set_parent_death_signal if sys.platform.startswith("linux") else None
+            ),
+        )
+        # 启动成功时输出: Starting to serve on 127.0.0.1:<port>
+        for line in proc.stdout:
+            match = PROXY_READY_RE.search(line)
+            if match:
+                break
+        else:
+            proc.kill()
+            proc.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode(errors="replace").strip()
+            sys.exit(f"kubectl proxy failed to start: {stderr}")
+
+        # proxy 只能随脚本一起退出，不能留下一个带着用户凭据的本地 API 端点：
+        # 正常退出走 atexit，SIGTERM/SIGHUP 转成 SystemExit 后同样走 atexit，
+        # SIGKILL 则由 PR_SET_PDEATHSIG 兜底
+        atexit.register(_stop_proxy, proc)
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGHUP):
+                if signal.getsignal(signum) is signal.SIG_DFL:
+                    signal.signal(signum, _exit_on_signal)
+        _proxy_port = int(match.group(1))
+        return _proxy_port
+
+
+def run_kubectl(args, text=False):
+    """Run kubectl and return its stdout, exiting with kubectl's stderr on failure."""
+    result = subprocess.run(["kubectl", *args], capture_output=True, text=text)
+    if result.returncode != 0:
+        stderr = result.stderr if text else result.stderr.decode()
+        sys.exit(f"kubectl failed (exit {result.returncode}): {stderr.strip()}")
+    return result.stdout
+
+
+def get_json(path):
+    """GET an API path (e.g. /api/v1/nodes) through the proxy and decode the JSON."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = http.client.HTTPConnection("127.0.0.1", start_proxy())
+
+    conn.request("GET", path)
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        sys.exit(f"GET {path} failed: {response.status} {body.decode()}")
+    return orjson.loads(body)
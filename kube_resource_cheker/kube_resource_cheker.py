@@ -1,8 +1,12 @@
 import argparse
-import json
+import io
+import sys
+from collections import Counter, defaultdict
 import re
 from concurrent.futures import ThreadPoolExecutor
-import subprocess
+from decimal import Decimal, InvalidOperation
+from urllib.parse import quote
+from kube_api import get_json, start_proxy
 
 # ANSI escape codes for colors
 PRIMARY_COLOR = "\033[93m"  # 亮黄色
@@ -10,25 +14,97 @@ SECONDARY_COLOR = "\033[93m"  # 亮黄色
 THIRDARY_COLOR = "\033[92m"  # 亮绿色
 RESET_COLOR = "\033[0m"
 
-
-def fetch_data():
-    """Fetch all nodes and pods data in one go."""
-    nodes_result = subprocess.run(
-        ["kubectl", "get", "nodes", "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    pods_result = subprocess.run(
-        ["kubectl", "get", "pods", "--all-namespaces", "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    nodes_data = json.loads(nodes_result.stdout)["items"]
-    pods_data = json.loads(pods_result.stdout)["items"]
-    return nodes_data, pods_data
+# 占用资源的 Pod 输出模板：namespace, name, resource_name, request
+POD_TEMPLATE = f"      {THIRDARY_COLOR}%s/%s requests %s: %s{RESET_COLOR}"
+
+# Kubernetes quantity suffixes and their multipliers
+QUANTITY_SUFFIXES = {
+    "Ki": 1024,
+    "Mi": 1024**2,
+    "Gi": 1024**3,
+    "Ti": 1024**4,
+    "Pi": 1024**5,
+    "Ei": 1024**6,
+    "m": Decimal("0.001"),
+    "k": 1000,
+    "M": 1000**2,
+    "G": 1000**3,
+    "T": 1000**4,
+    "P": 1000**5,
+    "E": 1000**6,
+}
+
+
+def slim_pod(pod):
+    """Keep only the pod fields needed to account resource requests."""
+    # 只保留有资源请求的容器，之后可以直接取 container["resources"]["requests"]
+    containers = []
+    for container in pod["spec"]["containers"]:
+        resources = container.get("resources")
+        requests = resources.get("requests") if resources else None
+        if requests:
+            containers.append({"resources": {"requests": requests}})
+
+    return {
+        "metadata": {
+            "namespace": pod["metadata"]["namespace"],
+            "name": pod["metadata"]["name"],
+        },
+        "spec": {
+            "nodeName": pod["spec"].get("nodeName"),
+            "containers": containers,
+        },
+        "status": {"phase": pod["status"]["phase"]},
+    }
 
 
-def get_nodes_with_label(nodes_data, label):
+def fetch_nodes():
+    """Fetch all nodes data."""
+    # resourceVersion=0 让 apiserver 直接从 watch cache 返回，不必读 etcd
+    return get_json("/api/v1/nodes?resourceVersion=0")["items"]
+
+
+def iter_pods(chunk_size):
+    """Yield all pods page by page, keeping only the fields used for accounting."""
+    # 分页获取 Pod 列表，每页处理完即可释放，避免整个列表常驻内存；
+    # 所有分页请求复用同一个 kubectl proxy 连接
+    continue_token = None
+    while True:
+        path = f"/api/v1/pods?limit={chunk_size}"
+        if continue_token:
+            path += f"&continue={quote(continue_token)}"
+        page = get_json(path)
+        for pod in page["items"]:
+            yield slim_pod(pod)
+
+        continue_token = page.get("metadata", {}).get("continue")
+        if not continue_token:
+            break
+
+
+def fetch_pods(chunk_size):
+    """Fetch pods with resource requests, indexed by nodeName."""
+    # 按 nodeName 建立 Pod 索引，避免每个节点都遍历全部 Pod
+    pods_by_node = defaultdict(list)
+    for pod in iter_pods(chunk_size):
+        # 只保留有资源请求的 Pod，系统 Pod 通常不请求任何资源
+        if pod["spec"]["containers"]:
+            pods_by_node[pod["spec"]["nodeName"]].append(pod)
+    return pods_by_node
+
+
+def fetch_data(chunk_size):
+    """Fetch all nodes data and the pods indexed by nodeName in one go."""
+    # proxy 必须在主线程启动，它的生命周期跟随启动它的线程
+    start_proxy()
+    # 并发请求 nodes 和 pods，总耗时取决于较慢的那个请求
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        nodes_future = executor.submit(fetch_nodes)
+        pods_future = executor.submit(fetch_pods, chunk_size)
+        return nodes_future.result(), pods_future.result()
+
+
+def get_nodes_with_label(nodes_data, label_re):
     """Filter nodes by label."""
     return [
         (
@@ -42,30 +118,40 @@ def get_nodes_with_label(nodes_data, label):
         )
         for node in nodes_data
         if any(
-            re.fullmatch(label, f"{k}={v}")
+            label_re.fullmatch(f"{k}={v}")
             for k, v in node["metadata"].get("labels", {}).items()
         )
     ]
 
 
 def parse_resource_amount(amount):
-    """Extract the numeric part of the resource amount, ignoring units."""
-    # Remove all non-digit characters
-    numeric_part = re.sub(r"[^\d]", "", amount)
-    if not numeric_part:
-        raise ValueError(f"Invalid resource amount format: {amount}")
-    return int(numeric_part)
-
-
-def find_resource_names(node_data, resource_keyword):
+    """Convert a Kubernetes quantity (e.g. "8", "500m", "32Gi") to a number."""
+    # Most amounts are plain integers, skip suffix handling for them
+    if amount.isdigit():
+        return int(amount)
+
+    number, multiplier = amount, 1
+    for suffix, factor in QUANTITY_SUFFIXES.items():
+        if amount.endswith(suffix):
+            number, multiplier = amount[: -len(suffix)], factor
+            break
+    try:
+        value = Decimal(number) * multiplier
+    except InvalidOperation:
+        raise ValueError(f"Invalid resource amount format: {amount}") from None
+    # Keep whole amounts as int, e.g. "2000m" -> 2, "1Gi" -> 1073741824
+    return int(value) if value == value.to_integral_value() else value.normalize()
+
+
+def find_resource_names(node_data, resource_re):
     """Find resources in the node matching the specified keyword."""
     allocatable_resources = node_data["status"]["allocatable"]
     matched_resources = {}
 
     for resource_name, amount in allocatable_resources.items():
-        if re.search(resource_keyword, resource_name, re.IGNORECASE):
+        if resource_re.search(resource_name):
             try:
-                # Attempt to parse resource amount, ignoring units
+                # Attempt to parse resource amount, applying units
                 matched_resources[resource_name] = parse_resource_amount(amount)
             except ValueError:
                 # If parsing fails, retain the original string value for display only
@@ -74,79 +160,65 @@ def find_resource_names(node_data, resource_keyword):
     return matched_resources
 
 
-def get_used_resources(node_name, pods_data, matched_resources):
-    """Calculate requested resources for active and all tasks on the specified node."""
-    used_resources_active = {
-        res: 0 for res in matched_resources if isinstance(matched_resources[res], int)
-    }
-    used_resources_all = {
-        res: 0 for res in matched_resources if isinstance(matched_resources[res], int)
-    }
-    resource_using_pods = {res: [] for res in matched_resources}
-
-    for pod in pods_data:
-        if pod["spec"].get("nodeName") == node_name:
-            for container in pod["spec"]["containers"]:
-                for resource_name, total_amount in matched_resources.items():
-                    # Only proceed if the total_amount is an integer (skipping string values)
-                    if isinstance(total_amount, int):
-                        resource_request = (
-                            container.get("resources", {})
-                            .get("requests", {})
-                            .get(resource_name)
+def get_used_resources(pods_on_node, resource_summaries):
+    """Add requests of active and all tasks on the node to the resource summaries."""
+    for pod in pods_on_node:
+        for container in pod["spec"]["containers"]:
+            requests = container["resources"]["requests"]
+            # Only numeric resources (keys of resource_summaries) are counted
+            for resource_name in requests.keys() & resource_summaries.keys():
+                resource_request = requests[resource_name]
+                if resource_request:
+                    try:
+                        used_request = parse_resource_amount(resource_request)
+                    except ValueError:
+                        # Skip if the request value cannot be converted
+                        continue
+                    resource_summary = resource_summaries[resource_name]
+                    resource_summary["used_all"] += used_request
+                    resource_summary["available_including_complete"] -= used_request
+                    if pod["status"]["phase"] == "Running":
+                        resource_summary["used_active"] += used_request
+                        resource_summary["available_excluding_complete"] -= used_request
+                        # 只记录 Pod 信息，输出时再格式化
+                        resource_summary["using_pods"].append(
+                            (
+                                pod["metadata"]["namespace"],
+                                pod["metadata"]["name"],
+                                resource_request,
+                            )
                         )
-                        if resource_request:
-                            try:
-                                used_request = parse_resource_amount(resource_request)
-                                used_resources_all[resource_name] += used_request
-                                if pod["status"]["phase"] == "Running":
-                                    used_resources_active[resource_name] += used_request
-                                    resource_using_pods[resource_name].append(
-                                        f'{pod["metadata"]["namespace"]}/{pod["metadata"]["name"]} requests {resource_name}: {resource_request}'
-                                    )
-                            except ValueError:
-                                # Skip if the request value cannot be converted
-                                pass
-
-    return used_resources_active, used_resources_all, resource_using_pods
-
-
-def process_node(node_info, pods_data, resource_keyword):
+
+
+def process_node(node_info, pods_by_node, resource_re):
     node_name, node_ip, node_data = node_info
-    matched_resources = find_resource_names(node_data, resource_keyword)
+    matched_resources = find_resource_names(node_data, resource_re)
 
     if not matched_resources:
         return None
 
-    used_resources_active, used_resources_all, resource_using_pods = get_used_resources(
-        node_name, pods_data, matched_resources
-    )
-
     node_summary = {
         "node_name": node_name,
         "node_ip": node_ip,
         "resources": [],
     }
+    resource_summaries = {}
 
     for resource_name, total_amount in matched_resources.items():
-        if isinstance(total_amount, int):  # Only proceed if total_amount is an integer
-            used_active = used_resources_active.get(resource_name, 0)
-            used_all = used_resources_all.get(resource_name, 0)
-
-            available_excluding_complete = total_amount - used_active
-            available_including_complete = total_amount - used_all
-
+        if not isinstance(total_amount, str):  # Only proceed if total_amount is numeric
+            # Available amounts start at the total and are reduced by each request
             resource_summary = {
                 "resource_name": resource_name,
                 "total": total_amount,
-                "available_excluding_complete": available_excluding_complete,
-                "available_including_complete": available_including_complete,
-                "used_active": used_active,
-                "used_all": used_all,
-                "using_pods": resource_using_pods[resource_name],
+                "available_excluding_complete": total_amount,
+                "available_including_complete": total_amount,
+                "used_active": 0,
+                "used_all": 0,
+                "using_pods": [],
             }
+            resource_summaries[resource_name] = resource_summary
         else:
-            # For non-integer resources, only display total and using pods info
+            # For non-numeric resources, only display total and using pods info
             resource_summary = {
                 "resource_name": resource_name,
                 "total": total_amount,
@@ -154,79 +226,83 @@ def process_node(node_info, pods_data, resource_keyword):
                 "available_including_complete": "N/A",
                 "used_active": "N/A",
                 "used_all": "N/A",
-                "using_pods": resource_using_pods[resource_name],
+                "using_pods": [],
             }
         node_summary["resources"].append(resource_summary)
 
+    get_used_resources(pods_by_node.get(node_name, []), resource_summaries)
+
     return node_summary
 
 
-def main(label, resource_keyword):
-    nodes_data, pods_data = fetch_data()
-    nodes = get_nodes_with_label(nodes_data, label)
+def main(label, resource_keyword, chunk_size=500):
+    # 输出先写入缓冲区，最后一次性写到 stdout
+    buf = io.StringIO()
+
+    nodes_data, pods_by_node = fetch_data(chunk_size)
+    label_re = re.compile(label)
+    resource_re = re.compile(resource_keyword, re.IGNORECASE)
+    nodes = get_nodes_with_label(nodes_data, label_re)
+
     overall_summary = {
         "nodes": [],
-        "totals": {},
-        "availables_excluding_complete": {},
-        "availables_including_complete": {},
+        "totals": Counter(),
+        "availables_excluding_complete": Counter(),
+        "availables_including_complete": Counter(),
     }
 
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_node, node_info, pods_data, resource_keyword)
-            for node_info in nodes
-        ]
-        for future in futures:
-            node_summary = future.result()
-            if not node_summary:
-                continue
-
-            print("--------------------------------------------------------")
-            print(f"\nNode: {node_summary['node_ip']} ({node_summary['node_name']})")
-            for resource in node_summary["resources"]:
-                print(f"  Resource: {resource['resource_name']}")
-                print(
-                    f"    Available: {PRIMARY_COLOR}{resource['available_excluding_complete']}{RESET_COLOR}, "
-                    f"{SECONDARY_COLOR}{resource['available_including_complete']}{RESET_COLOR} (Include Complete Tasks)"
-                )
-                print(
-                    f"    Total: {resource['total']}   Used (Active): {resource['used_active']}   Used (All): {resource['used_all']}"
-                )
-                if resource["using_pods"]:
-                    print(f"    Pods using {resource['resource_name']}:")
-                    for pod in resource["using_pods"]:
-                        print(f"      {THIRDARY_COLOR}{pod}{RESET_COLOR}")
-                else:
-                    print(f"    No Pods are using {resource['resource_name']}.")
-
-                # Update overall summary if total is an integer
-                if isinstance(resource["total"], int):
-                    overall_summary["totals"][resource["resource_name"]] = (
-                        overall_summary["totals"].get(resource["resource_name"], 0)
-                        + resource["total"]
-                    )
-                    overall_summary["availables_excluding_complete"][
-                        resource["resource_name"]
-                    ] = (
-                        overall_summary["availables_excluding_complete"].get(
-                            resource["resource_name"], 0
-                        )
-                        + resource["available_excluding_complete"]
-                    )
-                    overall_summary["availables_including_complete"][
-                        resource["resource_name"]
-                    ] = (
-                        overall_summary["availables_including_complete"].get(
-                            resource["resource_name"], 0
-                        )
-                        + resource["available_including_complete"]
-                    )
+    for node_info in nodes:
+        node_summary = process_node(node_info, pods_by_node, resource_re)
+        if not node_summary:
+            continue
 
-            overall_summary["nodes"].append(node_summary)
+        print("--------------------------------------------------------", file=buf)
+        print(
+            f"\nNode: {node_summary['node_ip']} ({node_summary['node_name']})", file=buf
+        )
+        for resource in node_summary["resources"]:
+            print(f"  Resource: {resource['resource_name']}", file=buf)
+            print(
+                f"    Available: {PRIMARY_COLOR}{resource['available_excluding_complete']}{RESET_COLOR}, "
+                f"{SECONDARY_COLOR}{resource['available_including_complete']}{RESET_COLOR} (Include Complete Tasks)",
+                file=buf,
+            )
+            print(
+                f"    Total: {resource['total']}   Used (Active): {resource['used_active']}   Used (All): {resource['used_all']}",
+                file=buf,
+            )
+            if resource["using_pods"]:
+                print(f"    Pods using {resource['resource_name']}:", file=buf)
+                for namespace, pod_name, resource_request in resource["using_pods"]:
+                    print(
+                        POD_TEMPLATE
+                        % (
+                            namespace,
+                            pod_name,
+                            resource["resource_name"],
+                            resource_request,
+                        ),
+                        file=buf,
+                    )
+            else:
+                print(f"    No Pods are using {resource['resource_name']}.", file=buf)
+
+            # Update overall summary if total is numeric
+            if not isinstance(resource["total"], str):
+                resource_name = resource["resource_name"]
+                overall_summary["totals"][resource_name] += resource["total"]
+                overall_summary["availables_excluding_complete"][
+                    resource_name
+                ] += resource["available_excluding_complete"]
+                overall_summary["availables_including_complete"][
+                    resource_name
+                ] += resource["available_including_complete"]
+
+        overall_summary["nodes"].append(node_summary)
 
     # Print overall summary
-    print(f"\n{PRIMARY_COLOR}Summary across all nodes:{RESET_COLOR}")
-    print("--------------------------------------------------------")
+    print(f"\n{PRIMARY_COLOR}Summary across all nodes:{RESET_COLOR}", file=buf)
+    print("--------------------------------------------------------", file=buf)
     for resource_name in overall_summary["totals"]:
         total = overall_summary["totals"][resource_name]
         available_excluding_complete = overall_summary["availables_excluding_complete"][
@@ -243,15 +319,19 @@ def main(label, resource_keyword):
             1 - (available_including_complete / total) if total else 0
         )
 
-        print(f"Resource: {resource_name}")
+        print(f"Resource: {resource_name}", file=buf)
         print(
             f"  Total: {total}"
-            f"  Available (Excluding Complete): {PRIMARY_COLOR}{available_excluding_complete}{RESET_COLOR}, Utilization: {THIRDARY_COLOR}{utilization_rate_excluding:.2%}{RESET_COLOR}"
+            f"  Available (Excluding Complete): {PRIMARY_COLOR}{available_excluding_complete}{RESET_COLOR}, Utilization: {THIRDARY_COLOR}{utilization_rate_excluding:.2%}{RESET_COLOR}",
+            file=buf,
         )
         print(
-            f"  Available (Including Complete): {SECONDARY_COLOR}{available_including_complete}{RESET_COLOR}, Utilization: {THIRDARY_COLOR}{utilization_rate_including:.2%}{RESET_COLOR}"
+            f"  Available (Including Complete): {SECONDARY_COLOR}{available_including_complete}{RESET_COLOR}, Utilization: {THIRDARY_COLOR}{utilization_rate_including:.2%}{RESET_COLOR}",
+            file=buf,
         )
-        print("--------------------------------------------------------")
+        print("--------------------------------------------------------", file=buf)
+
+    sys.stdout.write(buf.getvalue())
 
 
 if __name__ == "__main__":
@@ -267,6 +347,12 @@ if __name__ == "__main__":
         "--resource_keyword",
         help="Keyword to search for in resource names, e.g., 'gpu', 'cpu', 'memory', 'spiderpool'",
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=500,
+        help="Number of pods to fetch per API request (default: 500)",
+    )
     # 定义位置参数
     parser.add_argument(
         "positional_resource_keyword", nargs="?", help="Resource keyword (positional)"
@@ -288,5 +374,8 @@ if __name__ == "__main__":
     # 检查是否提供了必要的参数
     if not label or not resource_keyword:
         parser.error("Both label and resource_keyword are required.")
+    # limit=0 对 apiserver 来说等于不分页，必须在调用 main 之前拦下
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size must be a positive integer.")
 
-    main(label, resource_keyword)
+    main(label, resource_keyword, args.chunk_size)
@@ -1,7 +1,8 @@
 import argparse
-import subprocess
-import json
+from collections import defaultdict
 import re
+from urllib.parse import quote
+from kube_api import get_json
 
 # ANSI escape codes for colors
 PRIMARY_COLOR = "\033[93m"  # 亮黄色
@@ -12,12 +13,7 @@ RESET_COLOR = "\033[0m"
 
 def get_nodes_with_label(label):
     """Get all node names and IPs with a specific label."""
-    result = subprocess.run(
-        ["kubectl", "get", "nodes", "-l", label, "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    nodes = json.loads(result.stdout)["items"]
+    nodes = get_json(f"/api/v1/nodes?labelSelector={quote(label)}")["items"]
     return [
         (
             node["metadata"]["name"],
@@ -26,58 +22,49 @@ def get_nodes_with_label(label):
                 for addr in node["status"]["addresses"]
                 if addr["type"] == "InternalIP"
             ),
+            node,
         )
         for node in nodes
     ]
 
 
-def find_resource_names(node_name, resource_keyword):
+def get_all_pods():
+    """Get all pods across all namespaces."""
+    return get_json("/api/v1/pods")["items"]
+
+
+def find_resource_names(node_data, resource_re):
     """Use regex to find resources in the node that match the specified keyword."""
-    result = subprocess.run(
-        ["kubectl", "get", "node", node_name, "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    node_info = json.loads(result.stdout)
-    
-    allocatable_resources = node_info["status"]["allocatable"]
+    allocatable_resources = node_data["status"]["allocatable"]
     matched_resources = {
         resource_name: int(amount) for resource_name, amount in allocatable_resources.items()
-        if re.search(resource_keyword, resource_name, re.IGNORECASE)
+        if resource_re.search(resource_name)
     }
     
     return matched_resources
 
 
-def get_used_resources(node_name, matched_resources):
+def get_used_resources(pods_on_node, matched_resources):
     """Calculate requested resources for both active and all tasks on the specified node, and list pods using specified resources."""
-    result = subprocess.run(
-        ["kubectl", "get", "pods", "--all-namespaces", "-o", "json"],
-        capture_output=True,
-        text=True,
-    )
-    pods = json.loads(result.stdout)["items"]
-
     used_resources_active = {res: 0 for res in matched_resources}  # 排除 Complete 状态的资源请求
     used_resources_all = {res: 0 for res in matched_resources}     # 包括所有任务的资源请求
     resource_using_pods = {res: [] for res in matched_resources}   # 存储使用指定资源的 Pod 信息
 
-    for pod in pods:
-        if pod["spec"].get("nodeName") == node_name:
-            for container in pod["spec"]["containers"]:
-                for resource_name in matched_resources:
-                    resource_request = (
-                        container.get("resources", {})
-                        .get("requests", {})
-                        .get(resource_name)
-                    )
-                    if resource_request:
-                        used_resources_all[resource_name] += int(resource_request)
-                        if pod["status"]["phase"] == "Running":
-                            used_resources_active[resource_name] += int(resource_request)
-                            resource_using_pods[resource_name].append(
-                                f'{pod["metadata"]["namespace"]}/{pod["metadata"]["name"]} requests {resource_name}: {resource_request}'
-                            )
+    for pod in pods_on_node:
+        for container in pod["spec"]["containers"]:
+            resources = container.get("resources")
+            requests = resources.get("requests") if resources else None
+            if not requests:
+                continue
+            for resource_name in matched_resources:
+                resource_request = requests.get(resource_name)
+                if resource_request:
+                    used_resources_all[resource_name] += int(resource_request)
+                    if pod["status"]["phase"] == "Running":
+                        used_resources_active[resource_name] += int(resource_request)
+                        resource_using_pods[resource_name].append(
+                            f'{pod["metadata"]["namespace"]}/{pod["metadata"]["name"]} requests {resource_name}: {resource_request}'
+                        )
 
     return used_resources_active, used_resources_all, resource_using_pods
 
@@ -87,14 +74,21 @@ def main(label, resource_keyword):
     print("--------------------------------------------------------")
 
     nodes = get_nodes_with_label(label)
+    resource_re = re.compile(resource_keyword, re.IGNORECASE)
+    pods = get_all_pods()
+
+    # 按 nodeName 建立 Pod 索引，避免每个节点都遍历全部 Pod
+    pods_by_node = defaultdict(list)
+    for pod in pods:
+        pods_by_node[pod["spec"].get("nodeName")].append(pod)
     overall_totals = {}
     overall_availables_excluding_complete = {}
     overall_availables_including_complete = {}
     available_nodes_excluding_complete = []
     available_nodes_including_complete = []
 
-    for node_name, node_ip in nodes:
-        matched_resources = find_resource_names(node_name, resource_keyword)
+    for node_name, node_ip, node_data in nodes:
+        matched_resources = find_resource_names(node_data, resource_re)
         
         if not matched_resources:
             print(f"No resources found matching keyword '{resource_keyword}' on node {node_name}.")
@@ -102,7 +96,7 @@ def main(label, resource_keyword):
 
         print(f"\nNode: {node_ip} ({node_name})")
         node_totals = {res: matched_resources[res] for res in matched_resources}
-        used_resources_active, used_resources_all, resource_using_pods = get_used_resources(node_name, matched_resources)
+        used_resources_active, used_resources_all, resource_using_pods = get_used_resources(pods_by_node.get(node_name, []), matched_resources)
 
         for resource_name, total_amount in node_totals.items():
             used_active = used_resources_active[resource_name]